@@ -15,87 +15,71 @@ that specify a rectangle in Minecraft coordinates. The program will convert
 those coordinates to pixel coordinates and crop to that area.
 - The `tools/create_crop_preset.py` script can be used to create these presets.
 
+When cropping all the images, the cropped images can either be saved (as whole
+images or as tile pyramids for zoomable viewers), or be analysed for where and
+when the area changed, producing a heatmap of how often each pixel changed and a
+CSV with the changes in each image.
+
 The MC-coordinate to pixel-coordinate conversion is done using the offsets in
 the `ORIGIN_OFFSETS_PATH` file.
 - That file can be created using the `tools/align_images_to_coords.py` script.
+
+The input/output paths and the cropping itself live in `utils/cropping.py`,
+which `sharded_crop.py` shares.
 """
 
-import json
+import csv
+import functools
 import os
 import pathlib
+import sqlite3
 import tkinter as tk
-from dataclasses import dataclass
+from collections.abc import Iterable, Iterator
 
 import cv2 as cv
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 from tkinter import filedialog
 from tqdm import tqdm
 
+from utils.change_stats import CHANGES_CSV_HEADER, ChangeTracker
+from utils.coords import px_rects_to_mc
+from utils.cropping import (CROPS_DIR, INPUT_DIR, MAP_DIR,
+                            ORIGIN_OFFSETS_PATH, OUTPUT_DIR, CropPreset, execute_crop,
+                            get_crop_presets, get_crop_rects,
+                            get_origin_offsets, get_underlay, make_crop_preset)
+from utils.map_index import (find_covering_maps, get_indexed_origin_offsets,
+                             open_map_index)
 from utils.match_template import match_template
+from utils.tile_pyramid import TilePyramidWriter
 
-INPUT_DIR = "./input/"
-OUTPUT_DIR = "./output/"
-
-MAP_DIR = INPUT_DIR + "maps/"
-
-CROPS_DIR = INPUT_DIR + "crops/"
 TEMPLATE_DIR = CROPS_DIR + "templates/"
 DEFAULT_TEMPLATE_NAME = ""  # Leave empty to prompt user to specify
-UNDERLAYS_DIR = INPUT_DIR + "underlays/"
 
 ##################################################
-CROP_PRESETS = CROPS_DIR + "presets.json"
+MAP_INDEX_PATH = INPUT_DIR + "map_index.sqlite3"
 """
-This is a path to a JSON file with an array of cropping presets.
-
-The presets are specified as rectangles in Minecraft coordinates, which allows
-each image to be cropped to the same area even when the images are of different
-dimensions.
-
-These cropping templates are structured like this:
-```
-{
-  "title": "Template title",
-  "description": "Template description",
-  "rect": [x1, y1, x2, y2]  // These are **Minecraft in-game coordinates**, not
-                            // pixel coordinates. The coordinates the images are
-                            // aligned to are determined in `CENTERS_FILE_PATH`
-}
-```
-
-This script will, after a user selects a preset, convert the Minecraft coords to
-pixel coordinates and crop the image to that area.
+This is a path to an SQLite index of the map images (see
+`utils/map_index.py`), storing each image's dimensions, origin offset and the
+area it covers in Minecraft coordinates. It is created and brought up to date
+at the start of each bulk crop. Single-image crops and sharded runs don't use
+it, and read the origin offsets file directly.
 """
-##################################################
 
-##################################################
-ORIGIN_OFFSETS_PATH = INPUT_DIR + "origin_offsets.json"
-"""
-This is a path to a file with the pixel coordinates of where zero-zero is (or
-would be) on each map image. These coordinates act as an offset for each image,
-allowing pixel coordinates to be converted to what Minecraft coordinates in game
-that that pixel depicts (or vice versa).
-
-This file is structured like this:
-```
-{
-  "image_name.png": [x, y],
-  ...
-}
-```
-
-- image_name.png is the name of the image file in the `MAP_DIR` directory.
-- [x, y] represents a pixel coordinate in the image.
-  - That pixel coordinate is zero-zero in Minecraft coordinates.
-"""
+# if True, bulk crops read origin offsets through the map index, and skip map
+# images whose explored area does not overlap the crop rectangle at all,
+# without opening them
+ENABLE_MAP_INDEX = True
 ##################################################
 
-FONT = ImageFont.truetype("./fonts/UbuntuMono-Regular.ttf", 24)
+# where tile pyramids are written, and the image format of the tiles
+# (eg: "png" or "webp")
+TILES_DIR = OUTPUT_DIR + "tiles/"
+TILE_FORMAT = "png"
 
-# if True, we will add the image name each was cropped from to the top of the
-# output image
-ENABLE_INFO_ON_IMAGE = False
+# where the results of analysing changes across the cropped images are written
+CHANGES_HEATMAP_PATH = OUTPUT_DIR + "changes_heatmap.png"
+CHANGES_CSV_PATH = OUTPUT_DIR + "changes.csv"
 
 ##################################################
 
@@ -106,12 +90,6 @@ Image.MAX_IMAGE_PIXELS = None
 ##################################################
 
 
-@dataclass
-class CropPreset:
-  rect: tuple[int, int, int, int]
-  underlay: str | None
-
-
 def main():
   # Hide the tkinter root window
   root = tk.Tk()
@@ -142,7 +120,10 @@ def main():
 
     print(f"Selected image: {files[0]}")
 
-  origin_offsets = get_origin_offsets()
+  if is_bulk_crop and ENABLE_MAP_INDEX:
+    origin_offsets = get_indexed_origin_offsets(get_map_index())
+  else:
+    origin_offsets = get_origin_offsets()
 
   # stop if not all the filenames are present in the origins file
   if is_bulk_crop and len(origin_offsets) != len(os.listdir(MAP_DIR)):
@@ -161,139 +142,111 @@ def main():
     underlay_path = template.underlay
     first_offset = (0, 0)
   else:
-    first_crop_rect, first_offset = get_first_position(template)
-
-  underlay = get_underlay(underlay_path, first_crop_rect)
-
-  files = tqdm(files, unit="image")
-  for file_name in files:
-    if not file_name.endswith(".png"):
-      continue
-
-    files.set_description(f"Cropping {file_name}...")
-
-    # the zero-zero offset of the current image
-    curr_offset = origin_offsets[file_name]
-    net_offset = (  # the offset of this image relative to the first image
-        curr_offset[0] - first_offset[0],
-        curr_offset[1] - first_offset[1]
-    )
-
-    top_left, bottom_right = first_crop_rect
-
-    top_left = (top_left[0] + net_offset[0],
-                top_left[1] + net_offset[1])
-    bottom_right = (bottom_right[0] + net_offset[0],
-                    bottom_right[1] + net_offset[1])
-
-    img = execute_crop(file_name, top_left, bottom_right, underlay)
+    first_crop_rect, first_offset = get_first_position(template,
+                                                        origin_offsets)
 
-    if not os.path.exists(OUTPUT_DIR):
-      os.mkdir(OUTPUT_DIR)
+  output_mode = 0
+  if is_bulk_crop:
+    output_mode = prompt_select_from_list(
+        message="What do you want to do with the cropped images?",
+        options=[
+            "Save each cropped image",
+            "Save each cropped image as a tile pyramid (for zoomable viewers)",
+            "Analyse where and when the area changed (heatmap and CSV of changes)"
+        ])
+  is_tile_pyramid = output_mode == 1
+  is_analysis = output_mode == 2
+
+  underlay = None
+  if not is_analysis:
+    underlay = get_underlay(underlay_path, first_crop_rect)
+
+  files = [x for x in files if x.endswith(".png")]
+  if is_bulk_crop and ENABLE_MAP_INDEX:
+    files = get_covering_files(files, first_crop_rect, first_offset)
+
+  crop_rects = get_crop_rects(files, origin_offsets,
+                              first_crop_rect, first_offset)
+
+  if not os.path.exists(OUTPUT_DIR):
+    os.mkdir(OUTPUT_DIR)
+
+  if is_analysis:
+    analyse_changes(iter_crops(sorted(files), crop_rects, None, add_info=False))
+    return
+  if is_tile_pyramid:
+    write_tile_pyramids(iter_crops(sorted(files), crop_rects, underlay,
+                                   add_info=False))
+    return
+
+  for file_name, img in iter_crops(files, crop_rects, underlay):
     output_path = OUTPUT_DIR + file_name
     img.save(output_path)
 
   print("Done!")
 
 
-def execute_crop(img_file_name: str,
-                 top_left: tuple[int, int],
-                 bottom_right: tuple[int, int],
-                 underlay: Image.Image | None) -> Image.Image:
+def iter_crops(files: list[str],
+               crop_rects: dict[str, tuple[tuple[int, int], tuple[int, int]]],
+               underlay: Image.Image | None,
+               add_info: bool = True) -> Iterator[tuple[str, Image.Image]]:
   """
-  Crop the image to the specified rectangle, and return the cropped image.
-  Also add the underlay image underneath if one was specified.
+  Crop each of the images in turn, yielding the file name and cropped image.
+  Only one cropped image is held in memory at a time.
   """
 
-  img_path = MAP_DIR + img_file_name
-  img = Image.open(img_path)
-  img = crop_img(img, top_left, bottom_right)
-
-  # If an underlay image was specified, put it under the cropped image
-  if underlay:
-    img = add_underlay(img, underlay)
-  if ENABLE_INFO_ON_IMAGE:
-    img = add_img_info(img, img_file_name)
-
-  return img
-
-
-def get_underlay(underlay_path: str,
-                 first_crop_rect: tuple[tuple[int, int],
-                                        tuple[int, int]]) -> Image.Image | None:
-  if not underlay_path:
-    return None
-
-  try:
-    underlay = Image.open(underlay_path)  # Open the underlay image
-  except FileNotFoundError:
-    raise FileNotFoundError(f"Underlay image `{underlay_path}` not found.")
-
-  # Scale the underlay image to the size of the output rectangle
-  top_left, bottom_right = first_crop_rect
-  underlay = underlay.resize((bottom_right[0] - top_left[0],
-                              bottom_right[1] - top_left[1]),
-                             Image.NEAREST)
+  files = tqdm(files, unit="image")
+  for file_name in files:
+    files.set_description(f"Cropping {file_name}...")
 
-  # add a transluscent black overlay to the underlay image
-  underlay = Image.alpha_composite(underlay.convert("RGBA"),
-                                   Image.new("RGBA",
-                                             underlay.size,
-                                             (0, 0, 0, 200)))
+    top_left, bottom_right = crop_rects[file_name]
 
-  return underlay
+    yield (file_name,
+           execute_crop(file_name, top_left, bottom_right, underlay, add_info))
 
 
-def add_underlay(img: Image.Image, underlay: Image.Image) -> Image.Image:
+def write_tile_pyramids(crops: Iterable[tuple[str, Image.Image]]):
   """
-  Given the original image and an underlay image, combine the two by placing
-  the underlay image underneath the original image, such that any transparent
-  pixels would show the underlay image.
+  Write each of the (chronologically ordered) crops as a tile pyramid in
+  `TILES_DIR`, reusing tiles that haven't changed since the previous crop.
   """
 
-  # remove black pixels from the original image
-  img = make_black_transparent(img)
-
-  # only add the underlay image if the original image has any transparent
-  # pixels through which the underlay image would be visible.
-  if img.getchannel("A").getbbox():  # if image has any transparent pixels
-    # add the original image on top of the underlay image
-    # https://www.geeksforgeeks.org/python-pil-image-alpha_composite-method/
-    img = Image.alpha_composite(underlay.convert("RGBA"), img)
+  writer = TilePyramidWriter(TILES_DIR, TILE_FORMAT)
+  for file_name, img in crops:
+    writer.write(pathlib.Path(file_name).stem, img)
+  writer.write_index()
 
-  return img
+  print(f"Done! Encoded {writer.written_count} tiles and reused "
+        f"{writer.reused_count} unchanged tiles in {TILES_DIR}.")
 
 
-def make_black_transparent(img: Image.Image) -> Image.Image:
+def analyse_changes(crops: Iterable[tuple[str, Image.Image]]):
   """
-  Given an image, take each pixel, and if it is #000000, make it transparent.
-  https://stackoverflow.com/a/71859851
-  """
-
-  imga = img.convert("RGBA")  # n x m x 4
+  In one pass over the (chronologically ordered) crops, count how often each
+  pixel changed and where each image changed from the one before it.
 
-  imga = np.asarray(imga)
-  r, g, b, a = np.rollaxis(imga, axis=-1)  # split into 4 n x m arrays
-  r_m = r != 0  # binary mask for red channel, True for all non black values
-  g_m = g != 0  # binary mask for green channel, True for all non black values
-  b_m = b != 0  # binary mask for blue channel, True for all non black values
+  Writes a heatmap of the change counts to `CHANGES_HEATMAP_PATH` and a row of
+  change statistics per image to `CHANGES_CSV_PATH`.
+  """
 
-  # combine the three masks using the binary "or" operation
-  # this results in a mask that is True for any pixel that is not black
-  not_black_m = ((r_m == 1) | (g_m == 1) | (b_m == 1))
+  tracker = ChangeTracker()
 
-  # multiply the combined binary mask with the alpha channel
-  a = a * not_black_m
+  with open(CHANGES_CSV_PATH, "w", newline="") as f:
+    writer = csv.writer(f)
+    writer.writerow(CHANGES_CSV_HEADER)
 
-  # stack the img back together
-  imga = Image.fromarray(np.dstack([r, g, b, a]), "RGBA")
+    for file_name, img in crops:
+      writer.writerow(tracker.add_frame(file_name,
+                                        np.asarray(img.convert("RGB"))))
 
-  return imga
+  tracker.write_heatmap(CHANGES_HEATMAP_PATH)
+  print(f"Done! Written to {CHANGES_HEATMAP_PATH} and {CHANGES_CSV_PATH}.")
 
 
-def get_first_position(template: cv.Mat) -> tuple[tuple[tuple[int, int],
-                                                        tuple[int, int]],
-                                                  tuple[int, int]]:
+def get_first_position(template: cv.Mat,
+                       origin_offsets: dict[str, tuple[int, int]]
+                       ) -> tuple[tuple[tuple[int, int], tuple[int, int]],
+                                  tuple[int, int]]:
   """
   Take the first image in the `MAP_DIR` directory, then find the position of the
   template in that image.
@@ -313,21 +266,42 @@ def get_first_position(template: cv.Mat) -> tuple[tuple[tuple[int, int],
         f"First image `{first_img_name}` is not a PNG file.")
 
   crop_rectangle = match_template(MAP_DIR + first_img_name, template)
-  zero_zero_offset = get_origin_offsets()[first_img_name]
+  zero_zero_offset = origin_offsets[first_img_name]
 
   return (crop_rectangle, zero_zero_offset)
 
 
-def get_origin_offsets() -> dict[str, tuple[int, int]]:
+def get_covering_files(file_names: list[str],
+                       first_crop_rect: tuple[tuple[int, int],
+                                              tuple[int, int]],
+                       first_offset: tuple[int, int]) -> list[str]:
   """
-  Get the dictionary of each image's center coordinates.
+  Use the map index to filter out the images that don't show any explored part
+  of the crop rectangle, so that they don't have to be opened at all.
   """
 
-  if not os.path.exists(ORIGIN_OFFSETS_PATH):
-    raise FileNotFoundError(f"Centers file `{ORIGIN_OFFSETS_PATH}` not found.")
+  (x1, y1), (x2, y2) = first_crop_rect
+  mc_rect = px_rects_to_mc([[x1, y1, x2, y2]], np.array([first_offset]))[0, 0]
+
+  covering = set(find_covering_maps(get_map_index(), tuple(mc_rect.tolist())))
+  covering_files = [x for x in file_names if x in covering]
+
+  skipped_count = len(file_names) - len(covering_files)
+  if skipped_count:
+    print(f"Skipping {skipped_count} images that don't show the crop area.")
+
+  return covering_files
+
+
+@functools.cache
+def get_map_index() -> sqlite3.Connection:
+  """
+  Open the map index, bringing it up to date with the map images the first time
+  it is used. Only bulk crops use the index, since bringing it up to date reads
+  every new or changed map image.
+  """
 
-  with open(ORIGIN_OFFSETS_PATH, "r") as f:
-    return json.loads(f.read())
+  return open_map_index(MAP_INDEX_PATH, MAP_DIR, ORIGIN_OFFSETS_PATH)
 
 
 def prompt_for_template() -> cv.Mat | CropPreset:
@@ -362,14 +336,7 @@ def prompt_for_template() -> cv.Mat | CropPreset:
     return cv.imread(template_path, 0)
   else:
     # read the json file with cropping templates
-
-    if not os.path.exists(CROP_PRESETS):
-      raise FileNotFoundError(
-          f"Template file `{CROP_PRESETS}` not found.")
-
-    templates_data = None
-    with open(CROP_PRESETS, "r") as f:
-      templates_data = json.loads(f.read())
+    templates_data = get_crop_presets()
 
     options = [
         f"""  {x['title']} - {x['rect']}
@@ -377,20 +344,7 @@ def prompt_for_template() -> cv.Mat | CropPreset:
 """ for x in templates_data]
 
     template_idx = prompt_select_from_list(options, "Select crop template: ")
-    x1, y1, x2, y2 = templates_data[template_idx]["rect"]
-
-    rect = ((x1, y1), (x2, y2))
-
-    underlay = None
-    try:
-      underlay = UNDERLAYS_DIR + templates_data[template_idx]["underlay"]
-    except KeyError:
-      pass
-
-    return CropPreset(
-        rect=rect,
-        underlay=underlay
-    )
+    return make_crop_preset(templates_data[template_idx])
 
 
 def prompt_select_from_list(options: list[str],
@@ -418,29 +372,5 @@ def prompt_select_from_list(options: list[str],
   return selection_idx
 
 
-def add_img_info(img: Image.Image,
-                 info_text: str,
-                 section_height: int = 35) -> Image.Image:
-  """
-  Add a section at the top of the image with space to add some extra text.
-  """
-
-  dimensions = (img.width, img.height + section_height)
-  new_img = Image.new("RGBA", dimensions, "black")
-  new_img.paste(img, (0, section_height))
-
-  d = ImageDraw.Draw(new_img)
-  d.text((10, 5), info_text, font=FONT, fill="lightgray")
-
-  return new_img
-
-
-def crop_img(img: Image.Image,
-             top_left: tuple[int, int],
-             bottom_right: tuple[int, int]) -> Image.Image:
-  crop_rect = (top_left[0], top_left[1], bottom_right[0], bottom_right[1])
-  return img.crop(crop_rect)
-
-
 if __name__ == "__main__":
   main()
@@ -0,0 +1,145 @@
+"""
+Crop the images in the `MAP_DIR` directory to a preset in several independent
+shards, eg: to spread a long batch across multiple machines.
+
+The map images are deterministically split into shards (see
+`utils/sharding.py`). Each shard can be run on any host that can see the same
+`INPUT_DIR` and `OUTPUT_DIR`, with no coordination between them:
+```console
+$ python sharded_crop.py run --preset Worldborder --shards 4 --index 1
+$ python sharded_crop.py run --preset Worldborder --shards 4 --index 2
+...
+```
+
+Every shard writes its cropped images to `OUTPUT_DIR` and a manifest of them to
+`MANIFEST_DIR`. Once all shards are done, the merge step verifies that every map
+image was cropped exactly once and that no output is missing or corrupted, and
+writes the combined manifest to `MERGED_MANIFEST_PATH`:
+```console
+$ python sharded_crop.py merge --preset Worldborder --shards 4
+```
+"""
+
+import argparse
+import os
+
+from PIL import Image
+from tqdm import tqdm
+
+from utils.cropping import (MAP_DIR, OUTPUT_DIR, execute_crop,
+                            get_crop_presets, get_crop_rects,
+                            get_origin_offsets, get_underlay, make_crop_preset)
+from utils.sharding import (SHARD_STRATEGIES, get_manifest_path, hash_file,
+                            merge_manifests, split_into_shards,
+                            write_json_atomic)
+
+MANIFEST_DIR = OUTPUT_DIR + "manifests/"
+MERGED_MANIFEST_PATH = OUTPUT_DIR + "manifest.json"
+
+# disable PIL decompression bomb warning
+# https://github.com/python-pillow/Pillow/issues/4987
+Image.MAX_IMAGE_PIXELS = None
+
+
+def main():
+  args = parse_args()
+
+  shards = split_into_shards(
+      [x for x in os.listdir(MAP_DIR) if x.endswith(".png")],
+      args.shards,
+      args.strategy)
+  run_info = {
+      "preset": args.preset,
+      "strategy": args.strategy,
+      "shard_count": args.shards
+  }
+
+  if args.command == "run":
+    if not 1 <= args.index <= args.shards:
+      raise ValueError(f"Shard index must be between 1 and {args.shards}.")
+    run_shard(shards, args.index - 1, run_info)
+  else:
+    merged = merge_manifests(MANIFEST_DIR, OUTPUT_DIR, shards, run_info)
+    write_json_atomic(MERGED_MANIFEST_PATH, merged)
+    print(f"All {len(merged['outputs'])} outputs verified. "
+          f"Merged manifest written to {MERGED_MANIFEST_PATH}.")
+
+
+def parse_args() -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+  parser.add_argument("command", choices=["run", "merge"])
+  parser.add_argument("--preset", required=True,
+                      help="title of the crop preset to use")
+  parser.add_argument("--shards", type=int, required=True,
+                      help="total number of shards")
+  parser.add_argument("--index", type=int,
+                      help="which shard to run (1 to the number of shards)")
+  parser.add_argument("--strategy", choices=SHARD_STRATEGIES, default="range",
+                      help="how to split the maps into shards")
+
+  args = parser.parse_args()
+  if args.command == "run" and args.index is None:
+    parser.error("--index is required to run a shard")
+  return args
+
+
+def run_shard(shards: list[list[str]], shard_index: int, run_info: dict):
+  """
+  Crop every image in this shard to the preset and write the shard's manifest.
+  """
+
+  presets = [x for x in get_crop_presets() if x["title"] == run_info["preset"]]
+  if not presets:
+    raise ValueError(f"Crop preset `{run_info['preset']}` not found.")
+  preset = make_crop_preset(presets[0])
+
+  origin_offsets = get_origin_offsets()
+  file_names = shards[shard_index]
+
+  missing = [x for x in file_names if x not in origin_offsets]
+  if missing:
+    raise ValueError(
+        f"Map images {missing} do not have an origin offset in the origins "
+        "file.")
+
+  crop_rects = get_crop_rects(file_names, origin_offsets, preset.rect, (0, 0))
+  underlay = get_underlay(preset.underlay, preset.rect)
+
+  os.makedirs(OUTPUT_DIR, exist_ok=True)
+  os.makedirs(MANIFEST_DIR, exist_ok=True)
+
+  outputs: dict[str, dict] = {}
+
+  files = tqdm(file_names, unit="image")
+  for file_name in files:
+    files.set_description(f"Cropping {file_name}...")
+
+    top_left, bottom_right = crop_rects[file_name]
+    img = execute_crop(file_name, top_left, bottom_right, underlay)
+
+    # write to a temporary file first so that other hosts never see a
+    # half-written output in the shared directory
+    output_path = OUTPUT_DIR + file_name
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    img.save(tmp_path, format="PNG")
+    os.replace(tmp_path, output_path)
+
+    outputs[file_name] = {
+        "output": file_name,
+        "size": os.path.getsize(output_path),
+        "sha256": hash_file(output_path)
+    }
+
+  manifest_path = get_manifest_path(MANIFEST_DIR,
+                                    shard_index,
+                                    run_info["shard_count"])
+  write_json_atomic(manifest_path, {
+      **run_info,
+      "shard_index": shard_index + 1,
+      "outputs": outputs
+  })
+  print(f"Done! Manifest written to {manifest_path}.")
+
+
+if __name__ == "__main__":
+  main()
@@ -14,7 +14,6 @@ in each image. It will be written to `ORIGIN_OFFSETS_PATH`.
 import os
 import cv2 as cv
 import json
-import imagesize
 from tqdm import tqdm
 
 # extend sys.path to include the parent directory
@@ -32,15 +31,18 @@ ORIGIN_OFFSETS_PATH = INPUT_DIR + "origin_offsets.json"
 
 
 ##################################################
-ENABLE_SKIP_SAME_DIMENSIONS = True
+ENABLE_FINGERPRINT_FAST_PATH = True
 """
-if True, we will skip template matching to determine whether the map has been
-offset from the previous, if the dimensions of the curr image are the same
-as the previous image.
-
-In other words, this enables an optimisation where if dimensions are same
-between neighbouring images, we assume the map has not moved and reuse the
-offset from the previous image.
+if True, we will try to avoid template matching to determine how the map has
+been offset from the previous image.
+
+Each image gets a cheap fingerprint (hashes of its border strips and a few
+sampled rows) while it is read. If the fingerprint is the same as the previous
+image's, the map has not moved and the previous offset is reused. Otherwise,
+the few region-aligned shifts implied by the change in dimensions (see
+`REGION_SIZE` in `utils/region_align.py`) are checked against a sparse sample
+of pixels, and only if none of them fit do we fall back to full template
+matching.
 """
 ##################################################
 
@@ -102,6 +104,7 @@ def align_all_images(center_coords: tuple[int, int], original_template: cv.Mat):
   ```
   """
 
+  from utils.fingerprint import compute_fingerprint, read_map_with_fingerprint
   from utils.match_template import match_template
 
   # dictionary of each image's center coordinates
@@ -109,12 +112,13 @@ def align_all_images(center_coords: tuple[int, int], original_template: cv.Mat):
 
   # make a copy of the original template
   template = original_template.copy()
+  template_fingerprint = compute_fingerprint(template)
 
   # every time we shift the image, we add the offset to this
   cumulative_offset = (0, 0)
 
-  prev_iter_dims = None  # dimensions of the image in the previous iteration
-  prev_file_name = None  # name of the image in the previous iteration
+  matched_count = 0  # how many images needed full template matching
+  aligned_count = 0  # how many images were aligned in total
 
   # loop through all images in the directory
   file_loop = tqdm(os.listdir(MAP_DIR), unit="files")
@@ -124,29 +128,26 @@ def align_all_images(center_coords: tuple[int, int], original_template: cv.Mat):
       continue
 
     """
-    Use OpenCV template matching in order to find where the first image would
-    fit in this image. Then, use that information (the offset) to find where
-    0,0 has moved to in this image based on where it was in the first image.
+    Find where the previous image would fit in this image. Then, use that
+    information (the offset) to find where 0,0 has moved to in this image based
+    on where it was in the first image.
     """
 
-    # get dimensions of the current image
-    curr_iter_dims = imagesize.get(MAP_DIR + file_name)
+    img_path = MAP_DIR + file_name
+    curr_img, curr_fingerprint = read_map_with_fingerprint(img_path)
 
-    # if the dimensions are the same as the previous image AND the optimisation
-    # to skip these cases is enabled, we can skip, reusing the previous
-    # iteration's center coordinates
-    if ENABLE_SKIP_SAME_DIMENSIONS and prev_iter_dims == curr_iter_dims:
-      image_centers[file_name] = image_centers[prev_file_name]
-      file_loop.set_description(f"{file_name}: {image_centers[file_name]}")
-      prev_file_name = file_name
-      continue
+    offset_to_prev = None
+    if ENABLE_FINGERPRINT_FAST_PATH:
+      offset_to_prev = predict_offset(template, curr_img,
+                                      template_fingerprint, curr_fingerprint)
 
-    # match the template
-    img_path = MAP_DIR + file_name
-    top_left, _bottom_right = match_template(img_path, template)
+    # if the shift couldn't be predicted, match the template
+    if offset_to_prev is None:
+      offset_to_prev, _bottom_right = match_template(img_path, template)
+      matched_count += 1
+    aligned_count += 1
 
     # this is how much the previous image has been shifted in the current image
-    offset_to_prev = top_left
     new_center_coords = (
         center_coords[0] + cumulative_offset[0] + offset_to_prev[0],
         center_coords[1] + cumulative_offset[1] + offset_to_prev[1]
@@ -161,13 +162,34 @@ def align_all_images(center_coords: tuple[int, int], original_template: cv.Mat):
     image_centers[file_name] = new_center_coords
     file_loop.set_description(f"{file_name}: {new_center_coords}")
 
-    template = cv.imread(img_path, 0)
+    template = curr_img
+    template_fingerprint = curr_fingerprint
 
-    prev_iter_dims = curr_iter_dims
-    prev_file_name = file_name
+  print(f"Template matching was needed for {matched_count} of "
+        f"{aligned_count} images.")
 
   return image_centers
 
 
+def predict_offset(prev_img: cv.Mat,
+                   curr_img: cv.Mat,
+                   prev_fingerprint: str,
+                   curr_fingerprint: str) -> tuple[int, int] | None:
+  """
+  Try to work out how much the previous image has been shifted in the current
+  image without template matching.
+
+  Returns `None` if the shift could not be predicted confidently.
+  """
+
+  from utils.region_align import find_region_shift
+
+  # identical fingerprints mean the map has not moved
+  if prev_fingerprint == curr_fingerprint:
+    return (0, 0)
+
+  return find_region_shift(prev_img, curr_img)
+
+
 if __name__ == "__main__":
   main()
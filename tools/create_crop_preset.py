@@ -20,14 +20,22 @@ The user may then copy and paste the JSON into the `crops/presets.json` file.
 import imagesize
 import json
 import logging
+import os
 import pathlib
 import shutil
 import subprocess
 import tempfile
 
+import numpy as np
 import tkinter as tk
 from tkinter import filedialog
 
+# extend sys.path to include the parent directory
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.coords import px_rects_to_mc  # noqa: E402
+
 
 PAINT_DOT_NET_PATH = "C:/Program Files/paint.net/PaintDotNet.exe"
 INPUT_DIR = "../input/"
@@ -182,14 +190,9 @@ def conv_img_sel_box_to_mc_coords(img_sel_box: tuple[int, int, int, int],
   corresponding Minecraft **in-game coordinates**.
   """
 
-  x_off, y_off = origin_offset
+  mc_sel_box = px_rects_to_mc([img_sel_box], np.array([origin_offset]))
 
-  return (
-      img_sel_box[0] - x_off,
-      img_sel_box[1] - y_off,
-      img_sel_box[2] - x_off,
-      img_sel_box[3] - y_off
-  )
+  return tuple(mc_sel_box[0, 0].tolist())
 
 
 def prompt_preset_title_and_description(mc_sel_box: tuple[int, int, int, int]):
@@ -0,0 +1,74 @@
+import cv2 as cv
+import numpy as np
+
+CHANGES_CSV_HEADER = ["file_name", "changed_pixels", "changed_fraction",
+                      "bbox_x1", "bbox_y1", "bbox_x2", "bbox_y2"]
+"""
+Columns of the per-date changes CSV. The bounding box is of the changed pixels,
+in pixel coordinates of the cropped image (second corner exclusive), and empty
+if nothing changed.
+"""
+
+
+class ChangeTracker:
+  """
+  Accumulates, one cropped frame at a time, how often each pixel changed between
+  consecutive frames and where each frame changed.
+
+  Only the previous frame and one counter per pixel are kept, so memory use
+  does not grow with the number of frames.
+  """
+
+  def __init__(self):
+    self.prev_frame: np.ndarray | None = None
+    self.change_counts: np.ndarray | None = None
+
+  def add_frame(self, file_name: str, frame: np.ndarray) -> list:
+    """
+    Compare the frame with the previous one, add its changes to the per-pixel
+    counts, and return the frame's row for the changes CSV.
+    """
+
+    if self.prev_frame is None:
+      self.prev_frame = frame
+      self.change_counts = np.zeros(frame.shape[:2], dtype=np.uint32)
+      return [file_name, 0, 0.0, "", "", "", ""]
+
+    if frame.shape != self.prev_frame.shape:
+      raise ValueError(
+          f"`{file_name}` is {frame.shape[1]}x{frame.shape[0]} but the "
+          f"previous frame was {self.prev_frame.shape[1]}x"
+          f"{self.prev_frame.shape[0]}; all frames must be the same size.")
+
+    changed = frame != self.prev_frame
+    if changed.ndim == 3:
+      changed = changed.any(axis=-1)
+    self.change_counts += changed
+    self.prev_frame = frame
+
+    changed_pixels = int(np.count_nonzero(changed))
+    row = [file_name, changed_pixels, changed_pixels / changed.size]
+
+    if not changed_pixels:
+      return row + ["", "", "", ""]
+
+    rows = np.flatnonzero(changed.any(axis=1))
+    cols = np.flatnonzero(changed.any(axis=0))
+    return row + [int(cols[0]), int(rows[0]), int(cols[-1]) + 1,
+                  int(rows[-1]) + 1]
+
+  def write_heatmap(self, output_path: str):
+    """
+    Save the per-pixel change counts as a colour-mapped heatmap image, where
+    the pixels that changed most often are brightest.
+    """
+
+    if self.change_counts is None:
+      raise ValueError("No frames have been added.")
+
+    max_count = int(self.change_counts.max())
+    scaled = np.zeros(self.change_counts.shape, dtype=np.uint8)
+    if max_count:
+      scaled = (self.change_counts * (255 / max_count)).astype(np.uint8)
+
+    cv.imwrite(output_path, cv.applyColorMap(scaled, cv.COLORMAP_INFERNO))
@@ -0,0 +1,128 @@
+"""
+Convert between Minecraft in-game coordinates and pixel coordinates on the map
+images, for many points/rectangles and many images at once.
+
+Every image's zero-zero offset (from the origin offsets file) is loaded into one
+numpy array, so that projecting M points onto N images is a single vectorised
+operation instead of N * M loops in Python.
+
+Shapes used throughout:
+- points are `(..., 2)` arrays of x, y,
+- rects are `(..., 4)` arrays of x1, y1, x2, y2,
+- converting to/from pixel coordinates adds/expects a leading axis with one
+  entry per image, eg: M points become an `(N, M, 2)` array for N images.
+"""
+
+from dataclasses import dataclass
+
+import imagesize
+import numpy as np
+
+
+@dataclass
+class OffsetTable:
+  names: list[str]
+  """
+  The image names, in the same order as the rows of `offsets` and `dims`.
+  """
+  offsets: np.ndarray
+  """
+  `(N, 2)` array of the pixel coordinates of zero-zero on each image.
+  """
+  dims: np.ndarray | None = None
+  """
+  `(N, 2)` array of the width and height of each image, if known.
+  """
+
+
+def load_offset_table(origin_offsets: dict[str, tuple[int, int]],
+                      names: list[str] | None = None,
+                      map_dir: str | None = None) -> OffsetTable:
+  """
+  Load the origin offsets of the images in `names` (all of them by default)
+  into an `OffsetTable`.
+
+  If `map_dir` is given, the dimensions of each image are read from the image
+  headers in that directory, so that coordinates can be clipped to them.
+  """
+
+  if names is None:
+    names = list(origin_offsets)
+
+  offsets = np.array([origin_offsets[x] for x in names],
+                     dtype=np.int64).reshape(-1, 2)
+
+  dims = None
+  if map_dir is not None:
+    dims = np.array([imagesize.get(map_dir + x) for x in names],
+                    dtype=np.int64).reshape(-1, 2)
+
+  return OffsetTable(names=names, offsets=offsets, dims=dims)
+
+
+def mc_to_px(points: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+  """
+  Convert `(M, 2)` Minecraft coordinates to `(N, M, 2)` pixel coordinates on
+  each of the N images with the given offsets.
+  """
+
+  return np.asarray(points)[np.newaxis] + offsets[:, np.newaxis]
+
+
+def px_to_mc(points: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+  """
+  Convert `(N, M, 2)` pixel coordinates on each of the N images (or `(M, 2)`
+  pixel coordinates that are the same on every image) to `(N, M, 2)` Minecraft
+  coordinates.
+  """
+
+  return np.asarray(points) - offsets[:, np.newaxis]
+
+
+def mc_rects_to_px(rects: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+  """
+  Convert `(M, 4)` rectangles in Minecraft coordinates to `(N, M, 4)`
+  rectangles in pixel coordinates on each of the N images.
+  """
+
+  return np.asarray(rects)[np.newaxis] + np.tile(offsets, 2)[:, np.newaxis]
+
+
+def px_rects_to_mc(rects: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+  """
+  Convert `(N, M, 4)` (or `(M, 4)`) rectangles in pixel coordinates to
+  `(N, M, 4)` rectangles in Minecraft coordinates.
+  """
+
+  return np.asarray(rects) - np.tile(offsets, 2)[:, np.newaxis]
+
+
+def clip_rects_to_images(rects: np.ndarray, dims: np.ndarray) -> np.ndarray:
+  """
+  Clip `(N, M, 4)` pixel rectangles to the bounds of each of the N images with
+  the given `(N, 2)` dimensions.
+
+  Rectangles that are entirely outside of an image end up with zero area; see
+  `rects_visible`.
+  """
+
+  bounds = np.tile(dims, 2)[:, np.newaxis]  # w, h, w, h
+  return np.clip(rects, 0, bounds)
+
+
+def rects_visible(rects: np.ndarray) -> np.ndarray:
+  """
+  Get an `(N, M)` boolean mask of which (clipped) rectangles have any area.
+  """
+
+  return (rects[..., 2] > rects[..., 0]) & (rects[..., 3] > rects[..., 1])
+
+
+def points_in_images(points: np.ndarray, dims: np.ndarray) -> np.ndarray:
+  """
+  Get an `(N, M)` boolean mask of which `(N, M, 2)` pixel coordinates are
+  within the bounds of each of the N images.
+  """
+
+  bounds = dims[:, np.newaxis]
+  return np.all((points >= 0) & (points < bounds), axis=-1)
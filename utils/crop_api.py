@@ -0,0 +1,216 @@
+"""
+Crop map images in memory, without reading from `MAP_DIR` or writing to
+`OUTPUT_DIR`.
+
+This is the same cropping that `main.py` does, but everything is passed in as
+plain data, so that it can be imported and used by other programs (eg: a web
+service that receives map exports as uploads):
+- images can be encoded bytes (eg: PNG), numpy arrays, or PIL images,
+- origin offsets are `[x, y]` pairs, like in the origin offsets file,
+- presets are dicts with a `rect`, like in the crop presets file.
+
+```py
+from utils.crop_api import crop_maps
+
+crops = crop_maps({"2023-01-25.png": png_bytes},
+                  {"2023-01-25.png": [1024, 512]},
+                  {"rect": [-161, 520, 890, 1571]},
+                  encode_format="PNG")
+```
+
+Crops are returned as numpy arrays, or as encoded bytes if an `encode_format` is
+given. When a numpy array is passed in and the crop lies entirely inside it and
+needs no underlay, the returned array is a view into the original (no pixels
+are copied).
+"""
+
+import io
+
+import numpy as np
+from PIL import Image
+
+from utils import cropping
+from utils.coords import load_offset_table, mc_rects_to_px
+
+ImageSource = bytes | np.ndarray | Image.Image
+"""
+Anything that can be passed in as a map or underlay image.
+"""
+
+
+def open_image(source: bytes | Image.Image) -> Image.Image:
+  """
+  Open encoded image bytes as a PIL image. PIL images are returned as they are.
+  Decoding is lazy, so nothing is copied until the image is cropped.
+  """
+
+  if isinstance(source, (bytes, bytearray, memoryview)):
+    return Image.open(io.BytesIO(source))
+  if isinstance(source, Image.Image):
+    return source
+
+  raise TypeError(f"Unsupported image type `{type(source).__name__}`.")
+
+
+def get_array_mode(img: Image.Image) -> str:
+  """
+  Get the mode an image should be converted to before turning it into an array.
+
+  Palette ("P"), greyscale ("L", "LA"), 16-bit ("I;16") and other modes would
+  otherwise come out as arrays of palette indices or single channels, so
+  everything is normalised to "RGB", or "RGBA" if the image has transparency.
+  """
+
+  if img.mode in ("RGB", "RGBA"):
+    return img.mode
+  if "A" in img.getbands() or "transparency" in img.info:
+    return "RGBA"
+  return "RGB"
+
+
+def load_image(source: ImageSource) -> np.ndarray:
+  """
+  Get the pixels of an image as an RGB(A) numpy array. Arrays are returned as
+  they are.
+  """
+
+  if isinstance(source, np.ndarray):
+    return source
+
+  img = open_image(source)
+  return np.asarray(img.convert(get_array_mode(img)))
+
+
+def encode_image(img: np.ndarray, encode_format: str = "PNG") -> bytes:
+  """
+  Encode an image array into bytes of the given format (eg: PNG, WEBP).
+  """
+
+  buffer = io.BytesIO()
+  Image.fromarray(img).save(buffer, format=encode_format)
+  return buffer.getvalue()
+
+
+def crop_array(img: np.ndarray, rect: tuple[int, int, int, int]) -> np.ndarray:
+  """
+  Crop an image array to the rectangle (x1, y1, x2, y2, in pixel coordinates).
+
+  If the rectangle is entirely inside the image, a view is returned. Otherwise,
+  the parts outside of the image are filled with zeros, like `Image.crop` does.
+  """
+
+  x1, y1, x2, y2 = rect
+  img_h, img_w = img.shape[:2]
+
+  if x1 >= 0 and y1 >= 0 and x2 <= img_w and y2 <= img_h:
+    return img[y1:y2, x1:x2]
+
+  cropped = np.zeros((y2 - y1, x2 - x1) + img.shape[2:], dtype=img.dtype)
+
+  # the part of the rectangle that overlaps with the image
+  src_x1, src_y1 = max(x1, 0), max(y1, 0)
+  src_x2, src_y2 = min(x2, img_w), min(y2, img_h)
+  if src_x1 < src_x2 and src_y1 < src_y2:
+    cropped[src_y1 - y1:src_y2 - y1, src_x1 - x1:src_x2 - x1] = \
+        img[src_y1:src_y2, src_x1:src_x2]
+
+  return cropped
+
+
+def prepare_underlay(underlay: ImageSource,
+                     size: tuple[int, int]) -> Image.Image:
+  """
+  Scale the underlay to `size` (w, h) and darken it, the same way bulk crops
+  do (see `utils.cropping.prepare_underlay`).
+  """
+
+  if isinstance(underlay, np.ndarray):
+    underlay = Image.fromarray(underlay)
+
+  return cropping.prepare_underlay(open_image(underlay), size)
+
+
+def add_underlay(img: np.ndarray, underlay: Image.Image) -> np.ndarray:
+  """
+  Make the black pixels of the image transparent and place the (prepared)
+  underlay underneath it, the same way bulk crops do (see
+  `utils.cropping.add_underlay`).
+  """
+
+  return np.asarray(cropping.add_underlay(Image.fromarray(img), underlay))
+
+
+def crop_map(image: ImageSource,
+             origin_offset: tuple[int, int],
+             preset: dict,
+             underlay: Image.Image | None = None,
+             encode_format: str | None = None) -> np.ndarray | bytes:
+  """
+  Crop one map image to a preset.
+
+  `underlay` should already be prepared with `prepare_underlay`, so that it is
+  only scaled once for many maps.
+  """
+
+  rect = mc_rects_to_px([preset["rect"]], np.array([origin_offset]))[0, 0]
+  return crop_map_to_rect(image, tuple(rect.tolist()), underlay, encode_format)
+
+
+def crop_map_to_rect(image: ImageSource,
+                     rect: tuple[int, int, int, int],
+                     underlay: Image.Image | None = None,
+                     encode_format: str | None = None) -> np.ndarray | bytes:
+  """
+  Crop one map image to a rectangle that is already in pixel coordinates.
+
+  Arrays are cropped to a view where possible. Bytes and PIL images are cropped
+  before being converted to an array, so only the cropped area is copied.
+  """
+
+  if isinstance(image, np.ndarray):
+    img = crop_array(image, rect)
+  else:
+    pil_img = open_image(image)
+    mode = get_array_mode(pil_img)  # decided on the whole image's mode/info
+    img = np.asarray(pil_img.crop(rect).convert(mode))
+
+  if underlay is not None:
+    img = add_underlay(img, underlay)
+  if encode_format:
+    return encode_image(img, encode_format)
+
+  return img
+
+
+def crop_maps(images: dict[str, ImageSource],
+              origin_offsets: dict[str, tuple[int, int]],
+              preset: dict,
+              underlay: ImageSource | None = None,
+              encode_format: str | None = None) -> dict[str, np.ndarray | bytes]:
+  """
+  Crop every map image to the same preset.
+
+  Returns a dict of each image's crop, keyed by the same names as `images`.
+  """
+
+  missing = [x for x in images if x not in origin_offsets]
+  if missing:
+    raise ValueError(
+        f"Map images {missing} do not have an origin offset.")
+
+  prepared_underlay = None
+  if underlay is not None:
+    x1, y1, x2, y2 = preset["rect"]
+    prepared_underlay = prepare_underlay(underlay, (x2 - x1, y2 - y1))
+
+  # the preset's rectangle in pixel coordinates on every image at once
+  table = load_offset_table(origin_offsets, list(images))
+  rects = mc_rects_to_px([preset["rect"]], table.offsets)[:, 0].tolist()
+
+  return {
+      name: crop_map_to_rect(images[name],
+                             tuple(rect),
+                             prepared_underlay,
+                             encode_format)
+      for name, rect in zip(table.names, rects)
+  }
@@ -0,0 +1,299 @@
+"""
+The cropping that `main.py` and `sharded_crop.py` share: reading the input
+files, working out where the crop rectangle is on each map image, and cropping
+each image (with its underlay) to it.
+
+Nothing in here needs a display, so it can be imported on headless machines.
+"""
+
+import functools
+import json
+import os
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from utils.coords import load_offset_table, mc_rects_to_px, px_rects_to_mc
+
+INPUT_DIR = "./input/"
+OUTPUT_DIR = "./output/"
+
+MAP_DIR = INPUT_DIR + "maps/"
+
+CROPS_DIR = INPUT_DIR + "crops/"
+UNDERLAYS_DIR = INPUT_DIR + "underlays/"
+
+##################################################
+CROP_PRESETS = CROPS_DIR + "presets.json"
+"""
+This is a path to a JSON file with an array of cropping presets.
+
+The presets are specified as rectangles in Minecraft coordinates, which allows
+each image to be cropped to the same area even when the images are of different
+dimensions.
+
+These cropping templates are structured like this:
+```
+{
+  "title": "Template title",
+  "description": "Template description",
+  "rect": [x1, y1, x2, y2]  // These are **Minecraft in-game coordinates**, not
+                            // pixel coordinates. The coordinates the images are
+                            // aligned to are determined in `CENTERS_FILE_PATH`
+}
+```
+
+After a preset is selected, the Minecraft coords are converted to pixel
+coordinates and the image is cropped to that area.
+"""
+##################################################
+
+##################################################
+ORIGIN_OFFSETS_PATH = INPUT_DIR + "origin_offsets.json"
+"""
+This is a path to a file with the pixel coordinates of where zero-zero is (or
+would be) on each map image. These coordinates act as an offset for each image,
+allowing pixel coordinates to be converted to what Minecraft coordinates in game
+that that pixel depicts (or vice versa).
+
+This file is structured like this:
+```
+{
+  "image_name.png": [x, y],
+  ...
+}
+```
+
+- image_name.png is the name of the image file in the `MAP_DIR` directory.
+- [x, y] represents a pixel coordinate in the image.
+  - That pixel coordinate is zero-zero in Minecraft coordinates.
+"""
+##################################################
+
+FONT_PATH = "./fonts/UbuntuMono-Regular.ttf"
+
+# if True, we will add the image name each was cropped from to the top of the
+# output image
+ENABLE_INFO_ON_IMAGE = False
+
+##################################################
+
+
+@dataclass
+class CropPreset:
+  rect: tuple[int, int, int, int]
+  underlay: str | None
+
+
+def get_crop_presets() -> list[dict]:
+  """
+  Get the list of cropping presets from the `CROP_PRESETS` file.
+  """
+
+  if not os.path.exists(CROP_PRESETS):
+    raise FileNotFoundError(
+        f"Template file `{CROP_PRESETS}` not found.")
+
+  with open(CROP_PRESETS, "r") as f:
+    return json.loads(f.read())
+
+
+def make_crop_preset(preset_data: dict) -> CropPreset:
+  """
+  Turn one entry of the `CROP_PRESETS` file into a `CropPreset`.
+  """
+
+  x1, y1, x2, y2 = preset_data["rect"]
+
+  rect = ((x1, y1), (x2, y2))
+
+  underlay = None
+  try:
+    underlay = UNDERLAYS_DIR + preset_data["underlay"]
+  except KeyError:
+    pass
+
+  return CropPreset(
+      rect=rect,
+      underlay=underlay
+  )
+
+
+def get_origin_offsets() -> dict[str, tuple[int, int]]:
+  """
+  Get the dictionary of each image's center coordinates.
+  """
+
+  if not os.path.exists(ORIGIN_OFFSETS_PATH):
+    raise FileNotFoundError(f"Centers file `{ORIGIN_OFFSETS_PATH}` not found.")
+
+  with open(ORIGIN_OFFSETS_PATH, "r") as f:
+    return json.loads(f.read())
+
+
+def get_crop_rects(file_names: list[str],
+                   origin_offsets: dict[str, tuple[int, int]],
+                   first_crop_rect: tuple[tuple[int, int], tuple[int, int]],
+                   first_offset: tuple[int, int]) -> dict[str,
+                                                          tuple[tuple[int, int],
+                                                                tuple[int, int]]]:
+  """
+  Move the crop rectangle from the first image to where that same area is on
+  each of the images, all in one go.
+
+  Returns a dict of each image's crop rectangle in pixel coordinates.
+  """
+
+  (x1, y1), (x2, y2) = first_crop_rect
+
+  # convert the rectangle on the first image to Minecraft coordinates, then
+  # to pixel coordinates on every image
+  mc_rect = px_rects_to_mc([[x1, y1, x2, y2]], np.array([first_offset]))[0]
+  table = load_offset_table(origin_offsets, file_names)
+  px_rects = mc_rects_to_px(mc_rect, table.offsets)[:, 0].tolist()
+
+  return {
+      name: ((rect[0], rect[1]), (rect[2], rect[3]))
+      for name, rect in zip(table.names, px_rects)
+  }
+
+
+def execute_crop(img_file_name: str,
+                 top_left: tuple[int, int],
+                 bottom_right: tuple[int, int],
+                 underlay: Image.Image | None,
+                 add_info: bool = True) -> Image.Image:
+  """
+  Crop the image to the specified rectangle, and return the cropped image.
+  Also add the underlay image underneath if one was specified.
+
+  If `add_info` is False, the image name is not added to the image even if
+  `ENABLE_INFO_ON_IMAGE` is True.
+  """
+
+  img_path = MAP_DIR + img_file_name
+  img = Image.open(img_path)
+  img = crop_img(img, top_left, bottom_right)
+
+  # If an underlay image was specified, put it under the cropped image
+  if underlay:
+    img = add_underlay(img, underlay)
+  if ENABLE_INFO_ON_IMAGE and add_info:
+    img = add_img_info(img, img_file_name)
+
+  return img
+
+
+def get_underlay(underlay_path: str,
+                 first_crop_rect: tuple[tuple[int, int],
+                                        tuple[int, int]]) -> Image.Image | None:
+  if not underlay_path:
+    return None
+
+  try:
+    underlay = Image.open(underlay_path)  # Open the underlay image
+  except FileNotFoundError:
+    raise FileNotFoundError(f"Underlay image `{underlay_path}` not found.")
+
+  top_left, bottom_right = first_crop_rect
+  return prepare_underlay(underlay, (bottom_right[0] - top_left[0],
+                                     bottom_right[1] - top_left[1]))
+
+
+def prepare_underlay(underlay: Image.Image,
+                     size: tuple[int, int]) -> Image.Image:
+  """
+  Scale the underlay image to the size (w, h) of the output rectangle, and
+  darken it so that it can be told apart from the map on top of it.
+  """
+
+  underlay = underlay.resize(size, Image.NEAREST)
+
+  # add a transluscent black overlay to the underlay image
+  underlay = Image.alpha_composite(underlay.convert("RGBA"),
+                                   Image.new("RGBA",
+                                             underlay.size,
+                                             (0, 0, 0, 200)))
+
+  return underlay
+
+
+def add_underlay(img: Image.Image, underlay: Image.Image) -> Image.Image:
+  """
+  Given the original image and an underlay image, combine the two by placing
+  the underlay image underneath the original image, such that any transparent
+  pixels would show the underlay image.
+  """
+
+  # remove black pixels from the original image
+  img = make_black_transparent(img)
+
+  # only add the underlay image if the original image has any transparent
+  # pixels through which the underlay image would be visible.
+  if img.getchannel("A").getbbox():  # if image has any transparent pixels
+    # add the original image on top of the underlay image
+    # https://www.geeksforgeeks.org/python-pil-image-alpha_composite-method/
+    img = Image.alpha_composite(underlay.convert("RGBA"), img)
+
+  return img
+
+
+def make_black_transparent(img: Image.Image) -> Image.Image:
+  """
+  Given an image, take each pixel, and if it is #000000, make it transparent.
+  https://stackoverflow.com/a/71859851
+  """
+
+  imga = img.convert("RGBA")  # n x m x 4
+
+  imga = np.asarray(imga)
+  r, g, b, a = np.rollaxis(imga, axis=-1)  # split into 4 n x m arrays
+  r_m = r != 0  # binary mask for red channel, True for all non black values
+  g_m = g != 0  # binary mask for green channel, True for all non black values
+  b_m = b != 0  # binary mask for blue channel, True for all non black values
+
+  # combine the three masks using the binary "or" operation
+  # this results in a mask that is True for any pixel that is not black
+  not_black_m = ((r_m == 1) | (g_m == 1) | (b_m == 1))
+
+  # multiply the combined binary mask with the alpha channel
+  a = a * not_black_m
+
+  # stack the img back together
+  imga = Image.fromarray(np.dstack([r, g, b, a]), "RGBA")
+
+  return imga
+
+
+@functools.cache
+def get_font() -> ImageFont.FreeTypeFont:
+  """
+  Load the font used by `add_img_info`, the first time it is needed.
+  """
+
+  return ImageFont.truetype(FONT_PATH, 24)
+
+
+def add_img_info(img: Image.Image,
+                 info_text: str,
+                 section_height: int = 35) -> Image.Image:
+  """
+  Add a section at the top of the image with space to add some extra text.
+  """
+
+  dimensions = (img.width, img.height + section_height)
+  new_img = Image.new("RGBA", dimensions, "black")
+  new_img.paste(img, (0, section_height))
+
+  d = ImageDraw.Draw(new_img)
+  d.text((10, 5), info_text, font=get_font(), fill="lightgray")
+
+  return new_img
+
+
+def crop_img(img: Image.Image,
+             top_left: tuple[int, int],
+             bottom_right: tuple[int, int]) -> Image.Image:
+  crop_rect = (top_left[0], top_left[1], bottom_right[0], bottom_right[1])
+  return img.crop(crop_rect)
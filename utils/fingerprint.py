@@ -0,0 +1,69 @@
+import hashlib
+
+import cv2 as cv
+import numpy as np
+
+BORDER_STRIP_WIDTH = 8
+"""
+How many pixels thick the border strips that go into a fingerprint are.
+"""
+
+BORDER_DOWNSAMPLE_STEP = 4
+"""
+Only every n-th pixel along each border strip goes into the fingerprint.
+"""
+
+SAMPLED_ROW_COUNT = 16
+"""
+How many evenly spaced rows across the image are sampled, both for the
+fingerprint and for checking whether a candidate shift is correct (see
+`utils/region_align.py`).
+"""
+
+
+def read_map_with_fingerprint(img_path: str) -> tuple[cv.Mat, str]:
+  """
+  Read the map image at `img_path` in grayscale and compute its fingerprint in
+  the same pass, so that the file only has to be decoded once.
+  """
+
+  img = cv.imread(img_path, 0)
+  if img is None:
+    raise FileNotFoundError(f"Failed to load image `{img_path}`.")
+
+  return (img, compute_fingerprint(img))
+
+
+def compute_fingerprint(img: cv.Mat) -> str:
+  """
+  Compute a cheap fingerprint of a grayscale map image from its dimensions,
+  downsampled border strips, and a few sampled rows.
+
+  Two images with the same fingerprint are, for the purposes of alignment, the
+  same map in the same position.
+  """
+
+  h, w = img.shape[:2]
+  strip = BORDER_STRIP_WIDTH
+  step = BORDER_DOWNSAMPLE_STEP
+
+  digest = hashlib.blake2b(digest_size=16)
+  digest.update(np.array([w, h], dtype=np.int64).tobytes())
+
+  for border in (img[:strip, ::step],   # top
+                 img[-strip:, ::step],  # bottom
+                 img[::step, :strip],   # left
+                 img[::step, -strip:]):  # right
+    digest.update(np.ascontiguousarray(border).tobytes())
+
+  digest.update(np.ascontiguousarray(img[sample_rows(h)]).tobytes())
+
+  return digest.hexdigest()
+
+
+def sample_rows(height: int, count: int = SAMPLED_ROW_COUNT) -> np.ndarray:
+  """
+  Get the indices of `count` evenly spaced rows in an image of this height.
+  """
+
+  return np.unique(np.linspace(0, height - 1, num=count, dtype=np.int64))
@@ -0,0 +1,225 @@
+"""
+A small SQLite index of the map images, so that bulk runs can work out which
+maps actually show a given area without opening every image.
+
+For each map image, the index stores
+- its dimensions and origin offset,
+- the rectangle the whole image covers, in Minecraft coordinates,
+- the rectangle the explored (non-black) part of the image covers, in Minecraft
+  coordinates.
+
+A row is only recomputed when its image file (or the origin offsets file) has
+changed since it was indexed, so after the first run, updating the index only
+costs a `stat` per image.
+
+The index is meant to live on a local disk and be updated by one process at a
+time; SQLite's locking is not reliable on network shares.
+"""
+
+import json
+import os
+import sqlite3
+
+import imagesize
+import numpy as np
+from PIL import Image
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS maps (
+  name TEXT PRIMARY KEY,
+  mtime_ns INTEGER NOT NULL,
+  size INTEGER NOT NULL,
+  width INTEGER NOT NULL,
+  height INTEGER NOT NULL,
+  origin_x INTEGER,
+  origin_y INTEGER,
+  mc_x1 INTEGER,
+  mc_y1 INTEGER,
+  mc_x2 INTEGER,
+  mc_y2 INTEGER,
+  explored_px_x1 INTEGER,
+  explored_px_y1 INTEGER,
+  explored_px_x2 INTEGER,
+  explored_px_y2 INTEGER,
+  explored_x1 INTEGER,
+  explored_y1 INTEGER,
+  explored_x2 INTEGER,
+  explored_y2 INTEGER
+);
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL
+);
+"""
+"""
+Columns prefixed with `mc_` and `explored_` are in Minecraft coordinates, and
+`explored_px_` in pixel coordinates, all with the second corner exclusive. The
+Minecraft-coordinate columns are NULL if the image has no origin offset, and the
+explored columns are NULL if the image has no explored pixels.
+"""
+
+
+INDEX_LOCK_TIMEOUT = 300
+"""
+How many seconds to wait for another process to finish updating the index.
+"""
+
+
+def open_map_index(index_path: str,
+                   map_dir: str,
+                   origin_offsets_path: str) -> sqlite3.Connection:
+  """
+  Open the index at `index_path` (creating it if needed) and bring it up to date
+  with the images in `map_dir` and the origin offsets file.
+  """
+
+  # wait for another process that is updating the index, instead of failing
+  conn = sqlite3.connect(index_path, timeout=INDEX_LOCK_TIMEOUT)
+  conn.executescript(SCHEMA)
+
+  with conn:
+    update_map_index(conn, map_dir, origin_offsets_path)
+
+  return conn
+
+
+def update_map_index(conn: sqlite3.Connection,
+                     map_dir: str,
+                     origin_offsets_path: str):
+  """
+  Re-index every map image that is new or has changed, and drop the ones that
+  no longer exist.
+  """
+
+  if not os.path.exists(origin_offsets_path):
+    raise FileNotFoundError(f"Centers file `{origin_offsets_path}` not found.")
+
+  # only re-read the origin offsets file if it has changed
+  offsets_stamp = str(os.stat(origin_offsets_path).st_mtime_ns)
+  stored_stamp = conn.execute(
+      "SELECT value FROM meta WHERE key = 'origin_offsets_mtime_ns'"
+  ).fetchone()
+  offsets_changed = stored_stamp is None or stored_stamp[0] != offsets_stamp
+
+  origin_offsets = None
+  if offsets_changed:
+    with open(origin_offsets_path, "r") as f:
+      origin_offsets = json.loads(f.read())
+
+  indexed = {
+      row[0]: row[1:]
+      for row in conn.execute("SELECT name, mtime_ns, size FROM maps")
+  }
+
+  file_names = [x for x in os.listdir(map_dir) if x.endswith(".png")]
+  for file_name in file_names:
+    stat = os.stat(map_dir + file_name)
+    file_changed = indexed.get(file_name) != (stat.st_mtime_ns, stat.st_size)
+
+    if file_changed:
+      if origin_offsets is None:
+        with open(origin_offsets_path, "r") as f:
+          origin_offsets = json.loads(f.read())
+      index_map(conn, map_dir, file_name, stat, origin_offsets.get(file_name))
+    elif offsets_changed:
+      reindex_origin(conn, file_name, origin_offsets.get(file_name))
+
+  stale = set(indexed) - set(file_names)
+  conn.executemany("DELETE FROM maps WHERE name = ?",
+                   [(x,) for x in stale])
+
+  conn.execute("INSERT OR REPLACE INTO meta VALUES "
+               "('origin_offsets_mtime_ns', ?)", (offsets_stamp,))
+
+
+def index_map(conn: sqlite3.Connection,
+              map_dir: str,
+              file_name: str,
+              stat: os.stat_result,
+              origin_offset: tuple[int, int] | None):
+  """
+  Read one map image and (re)write its row in the index.
+  """
+
+  width, height = imagesize.get(map_dir + file_name)
+  explored_bbox = get_explored_bbox(map_dir + file_name) or (None,) * 4
+
+  conn.execute(
+      "INSERT OR REPLACE INTO maps (name, mtime_ns, size, width, height, "
+      "explored_px_x1, explored_px_y1, explored_px_x2, explored_px_y2) "
+      "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+      (file_name, stat.st_mtime_ns, stat.st_size, width, height,
+       *explored_bbox))
+  reindex_origin(conn, file_name, origin_offset)
+
+
+def reindex_origin(conn: sqlite3.Connection,
+                   file_name: str,
+                   origin_offset: tuple[int, int] | None):
+  """
+  Update the origin offset of an indexed map image, and the Minecraft-coordinate
+  rectangles that depend on it.
+  """
+
+  x_off, y_off = origin_offset or (None, None)
+
+  # SQL arithmetic with NULL gives NULL, so a missing offset (or a map with no
+  # explored pixels) leaves the Minecraft-coordinate columns NULL
+  conn.execute(
+      "UPDATE maps SET origin_x = :x, origin_y = :y, "
+      "mc_x1 = -:x, mc_y1 = -:y, mc_x2 = width - :x, mc_y2 = height - :y, "
+      "explored_x1 = explored_px_x1 - :x, explored_y1 = explored_px_y1 - :y, "
+      "explored_x2 = explored_px_x2 - :x, explored_y2 = explored_px_y2 - :y "
+      "WHERE name = :name",
+      {"x": x_off, "y": y_off, "name": file_name})
+
+
+def get_explored_bbox(img_path: str) -> tuple[int, int, int, int] | None:
+  """
+  Get the bounding box (x1, y1, x2, y2, in pixel coordinates) of the explored
+  part of a map image, ie: pixels that are neither black nor transparent.
+  """
+
+  imga = np.asarray(Image.open(img_path).convert("RGBA"))
+  explored = np.any(imga[..., :3] != 0, axis=-1) & (imga[..., 3] != 0)
+
+  rows = np.flatnonzero(explored.any(axis=1))
+  if rows.size == 0:
+    return None
+  cols = np.flatnonzero(explored.any(axis=0))
+
+  return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+
+def get_indexed_origin_offsets(
+        conn: sqlite3.Connection) -> dict[str, tuple[int, int]]:
+  """
+  Get the dictionary of each indexed image's origin offset, like the origin
+  offsets file, without reading that file.
+  """
+
+  return {
+      row[0]: (row[1], row[2])
+      for row in conn.execute(
+          "SELECT name, origin_x, origin_y FROM maps "
+          "WHERE origin_x IS NOT NULL ORDER BY name")
+  }
+
+
+def find_covering_maps(conn: sqlite3.Connection,
+                       mc_rect: tuple[int, int, int, int]) -> list[str]:
+  """
+  Get the names of the map images whose explored area overlaps the rectangle
+  (x1, y1, x2, y2, in Minecraft coordinates).
+  """
+
+  x1, y1, x2, y2 = mc_rect
+
+  return [
+      row[0]
+      for row in conn.execute(
+          "SELECT name FROM maps WHERE origin_x IS NOT NULL "
+          "AND explored_x1 < ? AND explored_x2 > ? "
+          "AND explored_y1 < ? AND explored_y2 > ? ORDER BY name",
+          (x2, x1, y2, y1))
+  ]
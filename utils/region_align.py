@@ -0,0 +1,126 @@
+"""
+Work out how a map export has shifted relative to the previous one by checking
+a few likely shifts, instead of searching every possible position with template
+matching.
+
+Xaero's World Map stores (and exports) the world in whole regions of 512x512
+blocks, so when an export grows, it grows by whole regions on some of its
+sides. The old map then sits inside the new one at a multiple of the region
+size, somewhere between not moving at all and moving by the full growth. Each
+of those few candidate shifts is checked by comparing a sparse sample of rows.
+"""
+
+import cv2 as cv
+import numpy as np
+
+from utils.fingerprint import sample_rows
+
+REGION_SIZE = 512
+"""
+The size, in pixels, of one map region in the exported images (512 blocks at
+one pixel per block).
+"""
+
+MIN_SHIFT_MATCH_RATIO = 0.9
+"""
+The fraction of compared pixels that have to be identical for a candidate shift
+to be accepted. Anything lower and we fall back to full template matching.
+"""
+
+MIN_COMPARED_PIXELS = 1000
+"""
+If fewer than this many explored (non-black) pixels overlap between the two
+images, there is not enough information to trust a candidate shift.
+"""
+
+
+def candidate_shifts(prev_dims: tuple[int, int],
+                     curr_dims: tuple[int, int],
+                     region_size: int = REGION_SIZE) -> list[tuple[int, int]]:
+  """
+  List the shifts of the previous map within the current one that are
+  consistent with how much the dimensions have grown, most likely first.
+
+  On each axis, the shift is a multiple of the region size between 0 and the
+  growth, or the growth itself (in case the growth isn't a whole number of
+  regions). If the map has shrunk, there are no candidates.
+  """
+
+  dw = curr_dims[0] - prev_dims[0]
+  dh = curr_dims[1] - prev_dims[1]
+  if dw < 0 or dh < 0:
+    return []
+
+  def axis_candidates(growth: int) -> list[int]:
+    # not moving and moving by all of the growth are the most common cases
+    candidates = [0, growth]
+    candidates += range(region_size, growth, region_size)
+    return list(dict.fromkeys(candidates))
+
+  def unlikeliness(shift: tuple[int, int]) -> int:
+    # how many of the axes have an in-between shift
+    return (shift[0] not in (0, dw)) + (shift[1] not in (0, dh))
+
+  shifts = [(x, y) for x in axis_candidates(dw) for y in axis_candidates(dh)]
+  return sorted(shifts, key=unlikeliness)
+
+
+def shift_match_ratio(prev_img: cv.Mat,
+                      curr_img: cv.Mat,
+                      shift: tuple[int, int]) -> float | None:
+  """
+  Compare a sparse sample of rows of the previous image with the current image,
+  assuming the previous image sits at `shift` (top left corner, in pixel
+  coordinates) inside it.
+
+  Only pixels that are explored (not black) in both images are compared, so
+  newly explored chunks do not count against the shift. Returns the fraction
+  of compared pixels that are identical, or `None` if the shift doesn't fit or
+  there were too few pixels to compare.
+  """
+
+  prev_h, prev_w = prev_img.shape[:2]
+  curr_h, curr_w = curr_img.shape[:2]
+  dx, dy = shift
+
+  if dx < 0 or dy < 0 or dx + prev_w > curr_w or dy + prev_h > curr_h:
+    return None
+
+  rows = sample_rows(prev_h)
+  prev_px = prev_img[rows]
+  curr_px = curr_img[rows + dy, dx:dx + prev_w]
+
+  explored = (prev_px != 0) & (curr_px != 0)
+  compared = np.count_nonzero(explored)
+  if compared < MIN_COMPARED_PIXELS:
+    return None
+
+  matching = np.count_nonzero((prev_px == curr_px) & explored)
+  return matching / compared
+
+
+def find_region_shift(prev_img: cv.Mat,
+                      curr_img: cv.Mat,
+                      region_size: int = REGION_SIZE) -> tuple[int, int] | None:
+  """
+  Find which of the candidate shifts the previous image is at inside the
+  current image.
+
+  Returns `None` if no candidate verifies, in which case the caller should fall
+  back to template matching.
+  """
+
+  prev_dims = prev_img.shape[1::-1]
+  curr_dims = curr_img.shape[1::-1]
+
+  best_shift, best_ratio = None, MIN_SHIFT_MATCH_RATIO
+  for shift in candidate_shifts(prev_dims, curr_dims, region_size):
+    ratio = shift_match_ratio(prev_img, curr_img, shift)
+    if ratio is None or ratio < best_ratio:
+      continue
+
+    best_shift, best_ratio = shift, ratio
+    if ratio == 1.0:  # can't do any better than a perfect match
+      break
+
+  return best_shift
@@ -0,0 +1,146 @@
+"""
+Helpers for splitting a batch of map images into shards that can be processed
+independently (eg: on different machines), and for merging the results back
+together.
+
+The only thing shards share is a directory. Each shard writes its outputs and a
+manifest describing them; the merge step reads every shard's manifest and checks
+that every map image was processed exactly once and that its output is intact.
+"""
+
+import hashlib
+import json
+import os
+
+SHARD_STRATEGIES = ("range", "hash")
+"""
+- `range` splits the (date-sorted) list of maps into contiguous date ranges.
+- `hash` assigns each map to a shard based on a hash of its file name, which
+  keeps assignments stable when new maps are added.
+"""
+
+
+def split_into_shards(file_names: list[str],
+                      shard_count: int,
+                      strategy: str = "range") -> list[list[str]]:
+  """
+  Deterministically split the map file names into `shard_count` shards.
+  The same input always produces the same split, whichever host computes it.
+  """
+
+  if shard_count < 1:
+    raise ValueError("Shard count must be at least 1.")
+  if strategy not in SHARD_STRATEGIES:
+    raise ValueError(f"Unknown shard strategy `{strategy}`.")
+
+  # map exports are named by date, so sorting by name sorts by date
+  file_names = sorted(file_names)
+  shards: list[list[str]] = [[] for _ in range(shard_count)]
+
+  if strategy == "range":
+    total = len(file_names)
+    for i in range(shard_count):
+      shards[i] = file_names[i * total // shard_count:
+                             (i + 1) * total // shard_count]
+  else:
+    for file_name in file_names:
+      digest = hashlib.blake2b(file_name.encode("utf-8"), digest_size=8)
+      shards[int(digest.hexdigest(), 16) % shard_count].append(file_name)
+
+  return shards
+
+
+def hash_file(path: str) -> str:
+  """
+  Get the SHA-256 hex digest of the file at `path`.
+  """
+
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def get_manifest_path(manifest_dir: str,
+                      shard_index: int,
+                      shard_count: int) -> str:
+  return os.path.join(manifest_dir,
+                      f"shard-{shard_index + 1}-of-{shard_count}.json")
+
+
+def write_json_atomic(path: str, data: dict):
+  """
+  Write `data` as JSON to `path` such that readers on a shared directory never
+  see a half-written file.
+  """
+
+  tmp_path = f"{path}.{os.getpid()}.tmp"
+  with open(tmp_path, "w") as f:
+    json.dump(data, f, indent=2)
+  os.replace(tmp_path, path)
+
+
+def merge_manifests(manifest_dir: str,
+                    output_dir: str,
+                    expected_shards: list[list[str]],
+                    run_info: dict) -> dict:
+  """
+  Read every shard's manifest, check that together they cover every expected
+  map image exactly once with an intact output file, and return the combined
+  manifest.
+
+  `run_info` holds the settings (preset, strategy, shard count) that every
+  shard's manifest has to agree with.
+
+  Raises a `ValueError` listing every problem found.
+  """
+
+  problems: list[str] = []
+  outputs: dict[str, dict] = {}
+  shard_count = len(expected_shards)
+
+  for shard_index, expected_files in enumerate(expected_shards):
+    manifest_path = get_manifest_path(manifest_dir, shard_index, shard_count)
+    if not os.path.exists(manifest_path):
+      problems.append(f"Manifest `{manifest_path}` is missing.")
+      continue
+
+    with open(manifest_path, "r") as f:
+      manifest = json.load(f)
+
+    for key, value in run_info.items():
+      if manifest.get(key) != value:
+        problems.append(f"Manifest `{manifest_path}` has {key} "
+                        f"`{manifest.get(key)}`, expected `{value}`.")
+
+    for file_name in expected_files:
+      entry = manifest["outputs"].get(file_name)
+      if entry is None:
+        problems.append(f"`{file_name}` was not processed by shard "
+                        f"{shard_index + 1}.")
+        continue
+      if file_name in outputs:
+        problems.append(f"`{file_name}` was processed by more than one shard.")
+        continue
+
+      output_path = os.path.join(output_dir, entry["output"])
+      if not os.path.exists(output_path):
+        problems.append(f"Output `{output_path}` is missing.")
+      elif (os.path.getsize(output_path) != entry["size"]
+            or hash_file(output_path) != entry["sha256"]):
+        problems.append(f"Output `{output_path}` does not match its manifest.")
+      outputs[file_name] = entry
+
+    unexpected = set(manifest["outputs"]) - set(expected_files)
+    for file_name in sorted(unexpected):
+      problems.append(f"`{file_name}` was processed by shard "
+                      f"{shard_index + 1}, but does not belong to it.")
+
+  if problems:
+    raise ValueError("Shards could not be merged:\n" + "\n".join(problems))
+
+  return {
+      **run_info,
+      "outputs": dict(sorted(outputs.items()))
+  }
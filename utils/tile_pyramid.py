@@ -0,0 +1,154 @@
+"""
+Write cropped images as tile pyramids, so that large crops can be viewed with a
+zoomable map viewer (eg: Leaflet) instead of downloading each full image.
+
+Each image is written as `<tiles dir>/<image name>/{z}/{x}/{y}.<format>`, where
+zoom level 0 is a single tile showing the whole image, and the highest zoom
+level is the image at full resolution. Each zoom level is generated by halving
+the one above it.
+
+Images are expected one date at a time, in chronological order. Tiles that are
+identical to the same tile of the previous image are not encoded again; they
+are hard-linked (or copied, where hard links aren't supported) from it.
+"""
+
+import hashlib
+import json
+import math
+import os
+import shutil
+
+import numpy as np
+from PIL import Image
+
+TILE_SIZE = 256
+
+
+class TilePyramidWriter:
+  def __init__(self, tiles_dir: str, tile_format: str = "png"):
+    self.tiles_dir = tiles_dir
+    self.tile_format = tile_format
+
+    # (z, x, y) -> (digest, path) of each tile written for the previous image
+    self.prev_tiles: dict[tuple[int, int, int], tuple[bytes, str]] = {}
+
+    self.index: list[dict] = []  # what has been written, for `write_index`
+    self.written_count = 0  # how many tiles were encoded
+    self.reused_count = 0  # how many tiles were reused from the previous image
+
+  def write(self, name: str, img: Image.Image):
+    """
+    Write the tile pyramid of one image to `<tiles dir>/<name>/`.
+    """
+
+    level = np.asarray(img.convert("RGBA"))
+    height, width = level.shape[:2]
+    max_zoom = get_max_zoom(width, height)
+
+    curr_tiles: dict[tuple[int, int, int], tuple[bytes, str]] = {}
+
+    for z in range(max_zoom, -1, -1):
+      if z < max_zoom:
+        level = halve(level)
+
+      for (x, y), tile in iter_tiles(level):
+        # don't write tiles that are entirely transparent
+        if not tile[..., 3].any():
+          continue
+
+        path = os.path.join(self.tiles_dir, name, str(z), str(x),
+                            f"{y}.{self.tile_format}")
+        digest = hashlib.blake2b(tile.tobytes(), digest_size=16).digest()
+        self.write_tile(tile, path, digest, self.prev_tiles.get((z, x, y)))
+        curr_tiles[(z, x, y)] = (digest, path)
+
+    self.prev_tiles = curr_tiles
+    self.index.append({
+        "name": name,
+        "width": width,
+        "height": height,
+        "max_zoom": max_zoom
+    })
+
+  def write_tile(self,
+                 tile: np.ndarray,
+                 path: str,
+                 digest: bytes,
+                 prev_tile: tuple[bytes, str] | None):
+    """
+    Write one tile, reusing the previous image's file for it if it is the same.
+    """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+      os.remove(path)
+
+    if prev_tile is not None and prev_tile[0] == digest:
+      try:
+        os.link(prev_tile[1], path)
+      except OSError:
+        shutil.copyfile(prev_tile[1], path)
+      self.reused_count += 1
+      return
+
+    Image.fromarray(tile, "RGBA").save(path)
+    self.written_count += 1
+
+  def write_index(self):
+    """
+    Write `index.json` to the tiles directory, listing every image written with
+    its size and zoom levels, for viewers to build a timeline from.
+    """
+
+    with open(os.path.join(self.tiles_dir, "index.json"), "w") as f:
+      json.dump({
+          "tile_size": TILE_SIZE,
+          "format": self.tile_format,
+          "images": self.index
+      }, f, indent=2)
+
+
+def get_max_zoom(width: int, height: int) -> int:
+  """
+  Get the zoom level at which an image of this size is at full resolution, if
+  zoom level 0 fits the whole image into a single tile.
+  """
+
+  return max(0, math.ceil(math.log2(max(width, height) / TILE_SIZE)))
+
+
+def halve(level: np.ndarray) -> np.ndarray:
+  """
+  Halve the resolution of an RGBA image array by averaging each 2x2 block,
+  padding odd dimensions with transparent pixels first.
+  """
+
+  height, width = level.shape[:2]
+  padded = np.zeros((height + height % 2, width + width % 2, 4),
+                    dtype=np.uint16)
+  padded[:height, :width] = level
+
+  halved = (padded[0::2, 0::2] + padded[1::2, 0::2]
+            + padded[0::2, 1::2] + padded[1::2, 1::2] + 2) // 4
+  return halved.astype(np.uint8)
+
+
+def iter_tiles(level: np.ndarray):
+  """
+  Split an RGBA image array into `TILE_SIZE` tiles, yielding `((x, y), tile)`.
+  Tiles on the right and bottom edges are padded with transparent pixels.
+  """
+
+  height, width = level.shape[:2]
+
+  for x in range(math.ceil(width / TILE_SIZE)):
+    for y in range(math.ceil(height / TILE_SIZE)):
+      tile = level[y * TILE_SIZE:(y + 1) * TILE_SIZE,
+                   x * TILE_SIZE:(x + 1) * TILE_SIZE]
+
+      if tile.shape[:2] != (TILE_SIZE, TILE_SIZE):
+        padded = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+        padded[:tile.shape[0], :tile.shape[1]] = tile
+        tile = padded
+
+      yield ((x, y), np.ascontiguousarray(tile))